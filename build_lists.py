@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+把八份名單 CSV 打包成單一 data/lists.pkl
+main.py 啟動時一次 pickle.load 即可，不必逐檔解析
+"""
+
+import pickle
+
+from main import BASE_DIR, DATA_DIR, LIST_CONFIG, LISTS_FILE
+
+
+def build(out_path=None):
+    out = out_path or LISTS_FILE
+    lists = {}
+    for key, cfg in LIST_CONFIG.items():
+        fp = DATA_DIR / cfg["file"]
+        if not fp.exists():
+            # 原始 CSV 若仍放在專案根目錄也接受
+            fp = BASE_DIR / cfg["file"]
+        if not fp.exists():
+            lists[key] = []
+            continue
+        row = fp.read_text(encoding="utf-8").strip()
+        lists[key] = [x.strip() for x in row.split(",") if x.strip()]
+    with open(out, "wb") as f:
+        pickle.dump(lists, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return out
+
+
+if __name__ == "__main__":
+    print(f"[INFO] 名單快照已寫入 {build()}")
@@ -5,20 +5,23 @@ LINE 服事排班機器人 – 主程式（main.py）
 """
 
 import os
-import json
-import schedule
+import sys
+import copy
+import pickle
+import atexit
+import base64
+import functools
+import hashlib
+import hmac
 import threading
 import time
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
-from flask import Flask, request, abort
+import orjson
 
-# ✅ v3 模組引入
-from linebot.v3.messaging import MessagingApi, Configuration, ApiClient, TextMessage, PushMessageRequest, ReplyMessageRequest
-from linebot.v3.webhook import WebhookHandler
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.exceptions import InvalidSignatureError
+# Flask 與 LINE SDK 採延後載入（見第 8 節與 _get_messaging_api），
+# cron 以 --run-weekly 一次性執行時不必付出整套 web stack 的 import 成本
 
 # ============================================================
 # 1. LINE Credentials
@@ -27,8 +30,22 @@ LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "YOUR_ACCESS_
 LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET", "YOUR_CHANNEL_SECRET")
 TARGET_ID = os.getenv("TARGET_ID", "YOUR_USER_OR_GROUP_ID")
 
-configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+_api_client = None
+_messaging_api = None
+_api_init_lock = threading.Lock()
+
+def _get_messaging_api():
+    # 常駐單一 ApiClient：連線池共用、免去每次推送重建 session / TLS 握手
+    # gunicorn 以多執行緒服務，首次初始化用雙重檢查鎖避免建出兩份連線池
+    global _api_client, _messaging_api
+    if _messaging_api is None:
+        with _api_init_lock:
+            if _messaging_api is None:
+                from linebot.v3.messaging import ApiClient, Configuration, MessagingApi
+                _api_client = ApiClient(Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN))
+                atexit.register(_api_client.close)
+                _messaging_api = MessagingApi(_api_client)
+    return _messaging_api
 
 # ============================================================
 # 2. 路徑與名單設定
@@ -48,44 +65,109 @@ LIST_CONFIG = {
     "url":       {"file": "url.csv",       "count": 1},
 }
 
+# indexes 以固定順序的 list 存放，查寫都是 C 層級的位置索引，不經 hash
+KEY_IDX = {k: i for i, k in enumerate(LIST_CONFIG)}
+
 STATE_FILE = DATA_DIR / "state.json"
-THIS_WEEK_FILE = DATA_DIR / "this_week.json"
+LISTS_FILE = DATA_DIR / "lists.pkl"     # build_lists.py 產生的整包名單快照
 DEFAULT_STATE = {
-    "indexes": {k: 0 for k in LIST_CONFIG},
-    "override": None
+    "indexes": [0] * len(LIST_CONFIG),
+    "override": None,
+    "this_week": ""
 }
 
 # ============================================================
 # 3. 公用函式
 # ============================================================
 
+@functools.lru_cache(maxsize=32)
+def _load_csv_cached(path_str: str, mtime_ns: int):
+    # mtime_ns 只作為快取鍵：檔案一變動，舊鍵失效、重新讀檔
+    # 名單都是一行逗號分隔的小檔，直接 os.read 省去 TextIOWrapper 的層層包裝
+    fd = os.open(path_str, os.O_RDONLY)
+    try:
+        raw = os.read(fd, 65536)
+    finally:
+        os.close(fd)
+    return tuple(x.strip() for x in raw.decode("utf-8").split(",") if x.strip())
+
+# 全部名單在 import 時凍結成 tuple 常駐記憶體（不可變、可安心共享），
+# 之後每 60 秒才 stat 一次來源檔，有異動才重建
+_LISTS_CHECK_INTERVAL = 60
+_lists_cache = {"mtime": 0, "checked": 0.0, "data": {}}
+
+def _load_lists():
+    if LISTS_FILE.exists():
+        mtime = LISTS_FILE.stat().st_mtime_ns
+        if mtime != _lists_cache["mtime"]:
+            with LISTS_FILE.open("rb") as f:
+                raw = pickle.load(f)
+            _lists_cache["data"] = {k: tuple(v) for k, v in raw.items()}
+            _lists_cache["mtime"] = mtime
+        return
+    # 尚未建立 lists.pkl 時逐檔讀取（_load_csv_cached 已按 mtime 快取），
+    # 並就地產生快照，下次啟動就走單一 pickle.load；部署端不必另跑 build_lists.py
+    data = {}
+    for key, cfg in LIST_CONFIG.items():
+        fp = DATA_DIR / cfg["file"]
+        data[key] = _load_csv_cached(str(fp), fp.stat().st_mtime_ns) if fp.exists() else ()
+    _lists_cache["data"] = data
+    _lists_cache["mtime"] = 0
+    if any(data.values()):      # 名單全空就不凍結快照，之後補上 CSV 仍能被讀到
+        try:
+            with LISTS_FILE.open("wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            _lists_cache["mtime"] = LISTS_FILE.stat().st_mtime_ns
+        except OSError as e:
+            print(f"[WARN] lists.pkl write failed: {e}")
+
 def load_csv_list(key: str):
-    fp = DATA_DIR / LIST_CONFIG[key]["file"]
-    if not fp.exists():
-        return []
-    with fp.open(encoding="utf-8") as f:
-        row = f.read().strip()
-    return [x.strip() for x in row.split(",") if x.strip()]
+    now = time.monotonic()
+    if now - _lists_cache["checked"] >= _LISTS_CHECK_INTERVAL:
+        _lists_cache["checked"] = now
+        _load_lists()
+    return _lists_cache["data"].get(key, ())
+
+_load_lists()
+
+# 檔案只有排班時才會寫入，webhook 卻可能每分鐘讀好幾次；
+# 這裡以 mtime 為準做記憶體快取，檔案沒變就不再碰磁碟
+_state_cache = {"mtime": 0, "data": None}
 
 def load_state():
-    if not STATE_FILE.exists():
-        save_state(DEFAULT_STATE)
-    return json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    mtime = STATE_FILE.stat().st_mtime_ns
+    if _state_cache["data"] is None or _state_cache["mtime"] != mtime:
+        data = orjson.loads(STATE_FILE.read_bytes())
+        if "this_week" not in data:
+            # 舊版另存 this_week.json，併入 state.json 後一次性遷移
+            legacy = DATA_DIR / "this_week.json"
+            data["this_week"] = (orjson.loads(legacy.read_bytes()).get("text", "")
+                                 if legacy.exists() else "")
+        if isinstance(data["indexes"], dict):
+            # 舊版以 {key: idx} 儲存，改成固定順序 list 後一次性遷移
+            data["indexes"] = [data["indexes"].get(k, 0) for k in LIST_CONFIG]
+        _state_cache["data"] = data
+        _state_cache["mtime"] = mtime
+    # deepcopy 保護快取不被 get_list_with_advance 的就地修改污染
+    return copy.deepcopy(_state_cache["data"])
 
 def save_state(state):
-    STATE_FILE.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    STATE_FILE.write_bytes(orjson.dumps(state))
+    _state_cache["data"] = copy.deepcopy(state)
+    _state_cache["mtime"] = STATE_FILE.stat().st_mtime_ns
 
-def load_this_week():
-    if THIS_WEEK_FILE.exists():
-        return json.loads(THIS_WEEK_FILE.read_text(encoding="utf-8"))
-    return {}
-
-def save_this_week(data):
-    THIS_WEEK_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+# 啟動時確保 state 檔存在，load_state 熱路徑就不必每次多一個 exists() stat
+if not STATE_FILE.exists():
+    save_state(DEFAULT_STATE)
 
 def next_items(lst, start_idx, n):
+    # 最多兩段 C 層級的 slice，不必逐元素取模
     length = len(lst)
-    return [lst[(start_idx + i) % length] for i in range(n)]
+    start = start_idx % length
+    end = start + n
+    if end <= length:
+        return list(lst[start:end])
+    return list(lst[start:]) + list(lst[:end - length])
 
 def advance_index(current, step, length):
     return (current + step) % length
@@ -98,36 +180,52 @@ def get_list_with_advance(key, state, advance=True):
     names = load_csv_list(key)
     if not names:
         return [], state
-    idx = state["indexes"][key]
+    slot = KEY_IDX[key]
+    idx = state["indexes"][slot]
     count = LIST_CONFIG[key]["count"]
     picked = next_items(names, idx, count)
     if advance:
-        state["indexes"][key] = advance_index(idx, count, len(names))
+        state["indexes"][slot] = advance_index(idx, count, len(names))
     return picked, state
 
-def bump_one(name_list, names_pool, avoid_set):
+# 名單 -> {姓名: 索引} 對照表，讓 bump_one 不必做 O(n) 的 list.index
+_pool_index_cache = {}
+
+def _pool_with_index(key):
+    names = load_csv_list(key)
+    cached = _pool_index_cache.get(key)
+    if cached is None or cached[0] != names:
+        cached = (names, {name: i for i, name in enumerate(names)})
+        _pool_index_cache[key] = cached
+    return cached
+
+def bump_one(name_list, names_pool, pool_idx, avoid_set):
     if not names_pool:
         return None
-    cur = names_pool.index(name_list[0])
-    for step in range(1, len(names_pool)):
-        candidate = names_pool[(cur + step) % len(names_pool)]
+    cur = pool_idx.get(name_list[0], 0)
+    length = len(names_pool)
+    for step in range(1, length):
+        candidate = names_pool[(cur + step) % length]
         if candidate not in avoid_set and candidate not in name_list:
             return candidate
     return name_list[0]
 
 def resolve_duplicates(hymn, bread_bro, sharing, topic, pianist, state):
-    pool_bro = load_csv_list("bread_bro")
+    pool_bro, idx_bro = _pool_with_index("bread_bro")
+    hymn_set = set(hymn)
+    avoid = hymn_set | set(bread_bro)
     for i, person in enumerate(bread_bro):
-        if person in hymn:
-            bread_bro[i] = bump_one([person], pool_bro, set(hymn + bread_bro))
+        if person in hymn_set:
+            bread_bro[i] = bump_one([person], pool_bro, idx_bro, avoid)
+            avoid.add(bread_bro[i])
 
-    pool_sharing = load_csv_list("sharing")
     if sharing and topic and sharing[0] == topic[0]:
-        sharing[0] = bump_one(sharing, pool_sharing, set(topic))
+        pool_sharing, idx_sharing = _pool_with_index("sharing")
+        sharing[0] = bump_one(sharing, pool_sharing, idx_sharing, set(topic))
 
-    pool_pianist = load_csv_list("pianist")
     if len(pianist) == 2 and pianist[0] == pianist[1]:
-        pianist[1] = bump_one([pianist[1]], pool_pianist, set(pianist[:1]))
+        pool_pianist, idx_pianist = _pool_with_index("pianist")
+        pianist[1] = bump_one([pianist[1]], pool_pianist, idx_pianist, set(pianist[:1]))
 
     return hymn, bread_bro, sharing, topic, pianist
 
@@ -135,9 +233,14 @@ def resolve_duplicates(hymn, bread_bro, sharing, topic, pianist, state):
 # 5. 特殊週判斷
 # ============================================================
 
+@functools.lru_cache(maxsize=4)
+def _first_monday_odd(ordinal: int) -> bool:
+    d = date.fromordinal(ordinal)
+    return d.month % 2 == 1 and 1 <= d.day <= 7 and d.weekday() == 0
+
 def is_first_monday_odd_month():
-    today = datetime.now()
-    return today.month % 2 == 1 and 1 <= today.day <= 7 and today.weekday() == 0
+    # 同一天內重複查詢（!status 輪詢）直接命中快取
+    return _first_monday_odd(date.today().toordinal())
 
 def is_special_week(state):
     if state["override"] == "special":
@@ -150,6 +253,19 @@ def is_special_week(state):
 # 6. 組合訊息
 # ============================================================
 
+# 模板只在模組載入時解析一次，每次組訊息只剩一個 .format 呼叫
+_TEMPLATE_NORMAL = (
+    "帶詩歌：{}\n"
+    "餅杯（弟兄）：{}\n"
+    "餅杯（姊妹）：{}\n"
+    "做餅：{}\n"
+    "分享：{}\n"
+    "司琴：{}\n"
+    "專題分享：{}\n"
+    "題目：{}"
+)
+_TEMPLATE_SPECIAL = "分享：{}\n司琴：（六）{}"
+
 def compose_message(state, advance=True):
     hymn, state = get_list_with_advance("hymn", state, advance)
     bread_bro, state = get_list_with_advance("bread_bro", state, advance)
@@ -163,18 +279,21 @@ def compose_message(state, advance=True):
     hymn, bread_bro, sharing, topic, pianist = resolve_duplicates(hymn, bread_bro, sharing, topic, pianist, state)
 
     if is_special_week(state):
-        msg = f"分享：{sharing[0] if sharing else ''}\n司琴：（六）{pianist[0] if pianist else ''}"
+        msg = _TEMPLATE_SPECIAL.format(
+            sharing[0] if sharing else "",
+            pianist[0] if pianist else "",
+        )
     else:
         pianist_text = f"（六）{pianist[0]}　（日）{pianist[1]}" if len(pianist) == 2 else ""
-        msg = (
-            f"帶詩歌：{'　'.join(hymn)}\n"
-            f"餅杯（弟兄）：{'　'.join(bread_bro)}\n"
-            f"餅杯（姊妹）：{'　'.join(bread_sis)}\n"
-            f"做餅：{baking[0] if baking else ''}\n"
-            f"分享：{sharing[0] if sharing else ''}\n"
-            f"司琴：{pianist_text}\n"
-            f"專題分享：{topic[0] if topic else ''}\n"
-            f"題目：{url[0] if url else ''}"
+        msg = _TEMPLATE_NORMAL.format(
+            "　".join(hymn),
+            "　".join(bread_bro),
+            "　".join(bread_sis),
+            baking[0] if baking else "",
+            sharing[0] if sharing else "",
+            pianist_text,
+            topic[0] if topic else "",
+            url[0] if url else "",
         )
     return msg, state
 
@@ -182,41 +301,83 @@ def compose_message(state, advance=True):
 # 7. 每週排班主程式
 # ============================================================
 
-def weekly_job():
-    state = load_state()
-    message, new_state = compose_message(state, advance=True)
-    save_state(new_state)
-    save_this_week({"text": message})
-    try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.push_message(PushMessageRequest(to=TARGET_ID, messages=[TextMessage(text=message)]))
-    except Exception as e:
-        print(f"[ERROR] push_message failed: {e}\nMessage:\n{message}")
-    else:
-        print("[INFO] Weekly message sent.")
+# 本週排班文字常駐記憶體，!resend 不必回磁碟讀 this_week.json
+_THIS_WEEK_TEXT = None
 
-def start_scheduler():
-    schedule.every().monday.at("09:00").do(weekly_job)
-    while True:
-        schedule.run_pending()
-        time.sleep(30)
+# LINE API 卡住時避免重疊執行把索引推進兩次、重複推送
+_weekly_lock = threading.Lock()
 
-threading.Thread(target=start_scheduler, daemon=True).start()
+def weekly_job():
+    global _THIS_WEEK_TEXT
+    if not _weekly_lock.acquire(blocking=False):
+        print("[WARN] weekly_job already running, skipped.")
+        return
+    try:
+        state = load_state()
+        message, new_state = compose_message(state, advance=True)
+        new_state["this_week"] = message
+        save_state(new_state)   # 索引與本週文字一次落盤，不會寫到一半不一致
+        _THIS_WEEK_TEXT = message
+        from linebot.v3.messaging import PushMessageRequest, TextMessage
+        try:
+            _get_messaging_api().push_message(PushMessageRequest(to=TARGET_ID, messages=[TextMessage(text=message)]))
+        except Exception as e:
+            print(f"[ERROR] push_message failed: {e}\nMessage:\n{message}")
+        else:
+            print("[INFO] Weekly message sent.")
+    finally:
+        _weekly_lock.release()
+
+def _next_monday_nine(now=None):
+    now = now or datetime.now()
+    target = (now + timedelta(days=(0 - now.weekday()) % 7)).replace(
+        hour=9, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=7)
+    return target
+
+def _fire():
+    weekly_job()
+    _schedule_next()
+
+def _schedule_next():
+    # 一週只醒一次，週一 09:00 觸發後再重新上膛
+    delay = (_next_monday_nine() - datetime.now()).total_seconds()
+    timer = threading.Timer(delay, _fire)
+    timer.daemon = True
+    timer.start()
+
+# 同主機 cron / systemd 部署可改用一次性呼叫：只跑排班，不載入 Flask
+if __name__ == "__main__" and "--run-weekly" in sys.argv:
+    weekly_job()
+    sys.exit(0)
+
+# Render 的 cron 服務跑在獨立容器、檔案系統與 web 服務不共用，
+# 寫回的 state 會隨容器結束而消失，因此排程定時器必須留在 web 行程內
+_schedule_next()
 
 # ============================================================
 # 8. Webhook v3 handler
 # ============================================================
+from flask import Flask, request, abort
+from linebot.v3.webhook import WebhookHandler
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+handler = WebhookHandler(LINE_CHANNEL_SECRET)
 app = Flask(__name__)
 
+def _verify_signature(body: bytes, signature: str) -> bool:
+    digest = hmac.new(LINE_CHANNEL_SECRET.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode("utf-8"))
+
 @app.route("/callback", methods=["POST"])
 def callback():
     signature = request.headers.get("X-Line-Signature", "")
-    body = request.get_data(as_text=True)
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    body = request.get_data()
+    # 偽造的請求在 JSON 解析之前就擋掉；compare_digest 恆定時間，不怕 timing 探測
+    if not _verify_signature(body, signature):
         abort(400)
+    handler.handle(body.decode("utf-8"), signature)
     return "OK"
 
 @handler.add(MessageEvent, message=TextMessageContent)
@@ -227,27 +388,29 @@ def handle_message(event):
     text = event.message.text.strip()
     reply_token = event.reply_token
 
+    from linebot.v3.messaging import PushMessageRequest, ReplyMessageRequest, TextMessage
+
     def reply(msg):
-        with ApiClient(configuration) as api_client:
-            MessagingApi(api_client).reply_message(
-                ReplyMessageRequest(reply_token=reply_token,
-                                    messages=[TextMessage(text=msg)])
-            )
+        _get_messaging_api().reply_message(
+            ReplyMessageRequest(reply_token=reply_token,
+                                messages=[TextMessage(text=msg)])
+        )
 
     def push(msg):
-        with ApiClient(configuration) as api_client:
-            MessagingApi(api_client).push_message(
-                PushMessageRequest(to=TARGET_ID,
-                                   messages=[TextMessage(text=msg)])
-            )
+        _get_messaging_api().push_message(
+            PushMessageRequest(to=TARGET_ID,
+                               messages=[TextMessage(text=msg)])
+        )
 
     if text.startswith("!status"):
         mode = "Special" if is_special_week(load_state()) else "Normal"
         reply(f"📌 當前模式：{mode}")
 
     elif text.startswith("!resend"):
-        week = load_this_week()
-        msg = week.get("text", "❗ 尚未產生本週排班")
+        msg = _THIS_WEEK_TEXT
+        if msg is None:     # 冷啟動後尚未重新排班才需要讀檔
+            msg = load_state().get("this_week")
+        msg = msg or "❗ 尚未產生本週排班"
         push(msg)
         reply("📤 本週排班已重新推送")
 
@@ -259,7 +422,14 @@ def handle_message(event):
         reply("⚠️ 指令未支援，目前支援指令有：\n\n`!status` – 查看當週模式\n`!resend` – 重送排班\n`!id` – 查詢你的使用者 ID")
 
 
+# gunicorn 啟動時 __main__ 區塊不會執行，首次部署（state 尚無本週文字）
+# 的排班改在 import 時補做；一般 import（工具、測試）不觸發
+if "gunicorn" in os.path.basename(sys.argv[0] or ""):
+    if not load_state().get("this_week"):
+        weekly_job()
+
 if __name__ == "__main__":
-    if not THIS_WEEK_FILE.exists():
+    if not load_state().get("this_week"):
         weekly_job()
+    # 僅供本機開發；正式環境由 gunicorn 啟動（見 Procfile / render.yaml）
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))